@@ -15,3 +15,7 @@ class UnknownNotificationMediaException(NotificationException):
 
 class InvalidNotificationMediaArgsException(NotificationException):
     pass
+
+
+class InvalidMessageTemplateException(NotificationException):
+    pass
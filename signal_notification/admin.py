@@ -1,9 +1,10 @@
 from django.contrib import admin
+from django.db.models import Count
 from django.forms import ModelForm, Select, forms
 
 from signal_notification import InvalidNotificationMediaArgsException
-from signal_notification.notify_media import get_registered_medias
-from .models import NotificationSetting
+from signal_notification.notify_media import get_registered_medias, validate_media_chain
+from .models import NotificationSetting, RecipientGroup, Recipient
 
 
 class NotificationSettingAdminForm(ModelForm):
@@ -32,6 +33,12 @@ class NotificationSettingAdminForm(ModelForm):
             raise forms.ValidationError(str(e.args[1]))
         return media_params
 
+    def clean_media_chain(self):
+        try:
+            return validate_media_chain(self.cleaned_data['media_chain']) or None
+        except InvalidNotificationMediaArgsException as e:
+            raise forms.ValidationError(str(e.args[1]))
+
 
 def notification_enable_action(modeladmin, request, queryset):
     queryset.update(enabled=True)
@@ -49,7 +56,8 @@ notification_disable_action.short_description = "Disable selected notification s
 
 class NotificationSettingAdmin(admin.ModelAdmin):
     list_display = (
-        'get_notification_name_display', 'get_media_name_display', 'enabled', 'update_by', 'update_datetime',
+        'get_notification_name_display', 'get_media_name_display', 'priority', 'enabled', 'update_by',
+        'update_datetime',
     )
     form = NotificationSettingAdminForm
     actions = [notification_enable_action, notification_disable_action]
@@ -70,3 +78,28 @@ class NotificationSettingAdmin(admin.ModelAdmin):
 
 
 admin.site.register(NotificationSetting, NotificationSettingAdmin)
+
+
+class RecipientGroupAdmin(admin.ModelAdmin):
+    list_display = ('name', 'kind', 'recipients_count', 'update_datetime')
+    list_filter = ('kind',)
+    search_fields = ('name',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(recipients_count=Count('recipients'))
+
+    def recipients_count(self, obj):
+        return obj.recipients_count
+
+    recipients_count.short_description = 'Recipients'
+
+
+class RecipientAdmin(admin.ModelAdmin):
+    list_display = ('address', 'group')
+    list_filter = ('group',)
+    search_fields = ('address',)
+    raw_id_fields = ('group',)
+
+
+admin.site.register(RecipientGroup, RecipientGroupAdmin)
+admin.site.register(Recipient, RecipientAdmin)
@@ -0,0 +1,40 @@
+import timeit
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.template import Template, Context
+
+from signal_notification.notify_formatter import compile_template
+
+DEFAULT_TEMPLATE = 'Failed login for "{{credentials.username}}" username! Remote ip: {{remote_ip|default:"unknown"}}'
+
+
+class Command(BaseCommand):
+    help = 'Compare the render time of django template engine and the fast message formatter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-n', '--number', type=int, default=10000, help='number of renders per engine')
+        parser.add_argument('-t', '--template', default=DEFAULT_TEMPLATE, help='inline message template')
+
+    def handle(self, *args, **options):
+        number = options['number']
+        template_string = options['template']
+        context = {
+            'user': AnonymousUser(), 'credentials': {'username': 'admin<script>'}, 'remote_ip': '127.0.0.1',
+        }
+        django_template = Template(template_string)
+        fast_render = compile_template(template_string)
+
+        expected = Template(template_string).render(Context(context))
+        result = fast_render(context)
+        if result != expected:
+            self.stderr.write('Engines output differ:\n  django: {}\n  fast:   {}'.format(expected, result))
+
+        benchmarks = [
+            ('django (compile + render)', lambda: Template(template_string).render(Context(context))),
+            ('django (render only)', lambda: django_template.render(Context(context))),
+            ('fast (render only)', lambda: fast_render(context)),
+        ]
+        for name, func in benchmarks:
+            elapsed = timeit.timeit(func, number=number)
+            self.stdout.write('{:<28} {:>10.2f} us/render'.format(name, elapsed / number * 1e6))
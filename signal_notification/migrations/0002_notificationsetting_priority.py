@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('signal_notification', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationsetting',
+            name='priority',
+            field=models.PositiveSmallIntegerField(blank=True, choices=[(10, 'Low'), (20, 'Normal'), (30, 'High')],
+                                                   help_text='Leave empty to use the handler priority', null=True),
+        ),
+    ]
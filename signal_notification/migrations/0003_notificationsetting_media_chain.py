@@ -0,0 +1,26 @@
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('signal_notification', '0002_notificationsetting_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationsetting',
+            name='latency_budget',
+            field=models.FloatField(blank=True, null=True,
+                                    help_text='Seconds to wait for the media before trying the next one of media chain'),
+        ),
+        migrations.AddField(
+            model_name='notificationsetting',
+            name='media_chain',
+            field=jsonfield.fields.JSONField(
+                blank=True, null=True,
+                help_text='Ordered fallback medias, e.g. [{"media_name": "email", "media_params": {...}, '
+                          '"latency_budget": 5}]'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('signal_notification', '0003_notificationsetting_media_chain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipientGroup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=128, unique=True)),
+                ('kind', models.CharField(choices=[('email', 'Email'), ('phone', 'Phone Number')], max_length=16)),
+                ('create_datetime', models.DateTimeField(auto_now_add=True)),
+                ('update_datetime', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Recipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('address', models.CharField(max_length=254)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients',
+                                            to='signal_notification.RecipientGroup')),
+            ],
+            options={
+                'unique_together': {('group', 'address')},
+            },
+        ),
+    ]
@@ -1,11 +1,16 @@
+import itertools
+
 import jsonfield
+from cerberus import Validator
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.db import models
 
 from signal_notification import InvalidNotificationMediaArgsException
 from signal_notification.notify_handlers import get_registered_handlers
-from signal_notification.notify_media import get_registered_medias
+from signal_notification.notify_media import get_registered_medias, validate_media_chain, RECIPIENT_KIND_CHOICES, \
+    RECIPIENT_ADDRESS_SCHEMAS
+from signal_notification.notify_scheduler import PRIORITY_CHOICES
 
 # Create your models here.
 
@@ -17,7 +22,15 @@ class NotificationSetting(models.Model):
     notification_rules = jsonfield.JSONField(null=True, blank=True)
     media_name = models.CharField(max_length=32)
     media_params = jsonfield.JSONField(null=True, blank=True)
+    latency_budget = models.FloatField(
+        null=True, blank=True, help_text='Seconds to wait for the media before trying the next one of media chain')
+    media_chain = jsonfield.JSONField(
+        null=True, blank=True,
+        help_text='Ordered fallback medias, e.g. [{"media_name": "email", "media_params": {...}, '
+                  '"latency_budget": 5}]')
     enabled = models.BooleanField(default=True)
+    priority = models.PositiveSmallIntegerField(
+        choices=PRIORITY_CHOICES, null=True, blank=True, help_text='Leave empty to use the handler priority')
     create_datetime = models.DateTimeField(auto_now_add=True)
     update_datetime = models.DateTimeField(auto_now=True)
     update_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, editable=False)
@@ -47,6 +60,9 @@ class NotificationSetting(models.Model):
     def validate_media_params(self):
         self.media_params = self.media_cls.validate_args(self.media_params)
 
+    def validate_media_chain(self):
+        self.media_chain = validate_media_chain(self.media_chain) or None
+
     def save(self, *args, **kwargs):
         if not self.notification_name:
             self.notification_name = None
@@ -59,6 +75,10 @@ class NotificationSetting(models.Model):
             self.validate_media_params()
         except InvalidNotificationMediaArgsException as e:
             raise ValidationError({'media_params': e.args})
+        try:
+            self.validate_media_chain()
+        except InvalidNotificationMediaArgsException as e:
+            raise ValidationError({'media_chain': e.args})
         super().save(*args, **kwargs)
 
     @property
@@ -72,3 +92,50 @@ class NotificationSetting(models.Model):
 
     def __str__(self):
         return self.notification_name_display
+
+
+class RecipientGroup(models.Model):
+    name = models.CharField(max_length=128, unique=True)
+    kind = models.CharField(max_length=16, choices=RECIPIENT_KIND_CHOICES)
+    create_datetime = models.DateTimeField(auto_now_add=True)
+    update_datetime = models.DateTimeField(auto_now=True)
+
+    def validate_addresses(self, addresses):
+        """Validate addresses by the kind of group, return the invalid ones"""
+        v = Validator({'address': RECIPIENT_ADDRESS_SCHEMAS[self.kind]})
+        return [a for a in addresses if not v.validate({'address': a})]
+
+    def add_recipients(self, addresses, batch_size=1000):
+        """Validate and bulk insert addresses, skipping the ones which are already in the group"""
+        addresses = iter(addresses)
+        while True:
+            batch = set(itertools.islice(addresses, batch_size))
+            if not batch:
+                return
+            invalid = self.validate_addresses(batch)
+            if invalid:
+                raise ValidationError({'address': 'Invalid addresses: {}'.format(sorted(invalid))})
+            batch -= set(self.recipients.filter(address__in=batch).values_list('address', flat=True))
+            Recipient.objects.bulk_create([Recipient(group=self, address=a) for a in sorted(batch)])
+
+    def __str__(self):
+        return self.name
+
+
+class Recipient(models.Model):
+    group = models.ForeignKey(RecipientGroup, on_delete=models.CASCADE, related_name='recipients')
+    address = models.CharField(max_length=254)
+
+    class Meta:
+        unique_together = ('group', 'address')
+
+    def clean(self):
+        if self.group_id is not None and self.group.validate_addresses([self.address]):
+            raise ValidationError({'address': 'Invalid {} address: {}'.format(self.group.kind, self.address)})
+
+    def save(self, *args, **kwargs):
+        self.clean()
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.address
@@ -0,0 +1,255 @@
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+OVERFLOW_BLOCK = 'block'
+OVERFLOW_DROP_OLDEST = 'drop_oldest'
+OVERFLOW_DROP_NEWEST = 'drop_newest'
+OVERFLOW_SPILL = 'spill'
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_DROP_NEWEST, OVERFLOW_SPILL)
+
+DEFAULT_BUFFER_CAPACITY = 1000
+DEFAULT_BUFFER_TIMEOUT = 1
+DEFAULT_SPILL_SIZE = 64 * 1024 * 1024
+
+_SPILL_HEADER = struct.Struct('<I')
+
+
+class EventRecord(object):
+    """Compact record of one notification waiting for delivery"""
+
+    __slots__ = ('handler_name', 'setting_id', 'priority', 'context', 'created')
+
+    def __init__(self, handler_name, setting_id, priority, context, created=None):
+        self.handler_name = handler_name
+        self.setting_id = setting_id
+        self.priority = priority
+        self.context = context
+        self.created = time.monotonic() if created is None else created
+
+    def __repr__(self):
+        return '<EventRecord {} #{} priority={}>'.format(self.handler_name, self.setting_id, self.priority)
+
+
+def picklable_context(context):
+    """Return the items of a template context which can be pickled.
+
+    The `signal` sent by django and values like `request` can't be pickled, so they are left out.
+    """
+    picklable = {}
+    for key, value in (context or {}).items():
+        if key == 'signal':
+            continue
+        try:
+            pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            continue
+        picklable[key] = value
+    return picklable
+
+
+class SpillFile(object):
+    """Append-only memory mapped file of length prefixed pickled records.
+
+    The file is created with a unique name in `directory` (see tempfile.mkstemp), so it is private to the process
+    which created it. Records are read back in the order they were appended. The space is reclaimed when the file is
+    fully drained.
+    """
+
+    def __init__(self, directory, size):
+        fd, self.path = tempfile.mkstemp(prefix='signal-notification-', suffix='.spill', dir=directory)
+        self.size = size
+        self._file = os.fdopen(fd, 'w+b')
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self._read_offset = 0
+        self._write_offset = 0
+        self.count = 0
+
+    def append(self, data):
+        end = self._write_offset + _SPILL_HEADER.size + len(data)
+        if end > self.size:
+            return False
+        _SPILL_HEADER.pack_into(self._mmap, self._write_offset, len(data))
+        self._mmap[self._write_offset + _SPILL_HEADER.size:end] = data
+        self._write_offset = end
+        self.count += 1
+        return True
+
+    def pop(self):
+        if not self.count:
+            return None
+        length, = _SPILL_HEADER.unpack_from(self._mmap, self._read_offset)
+        start = self._read_offset + _SPILL_HEADER.size
+        data = self._mmap[start:start + length]
+        self.count -= 1
+        if self.count:
+            self._read_offset = start + length
+        else:
+            self._read_offset = self._write_offset = 0
+        return data
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class NotificationBuffer(object):
+    """Thread-safe bounded FIFO buffer of EventRecord objects.
+
+    When the buffer is full, `overflow_policy` decides what happens to a new record:
+        - block: wait up to `timeout` seconds for free space, then drop the new record
+        - drop_oldest: drop the oldest buffered record
+        - drop_newest: drop the new record
+        - spill: append the record to a memory mapped file in `spill_dir`; it is moved back to memory as soon as
+          there is free space. Records which do not fit in the file are dropped, and the ones which cannot be
+          pickled or unpickled are dropped and counted in `pickle_errors` (see picklable_context).
+    A `condition` can be shared between several buffers, so one consumer can wait on all of them.
+    """
+
+    def __init__(self, capacity=None, overflow_policy=None, timeout=None, spill_dir=None, spill_size=None,
+                 condition=None):
+        self.capacity = capacity or getattr(settings, 'SIGNAL_NOTIFICATION_BUFFER_CAPACITY', DEFAULT_BUFFER_CAPACITY)
+        self.overflow_policy = overflow_policy or getattr(
+            settings, 'SIGNAL_NOTIFICATION_BUFFER_OVERFLOW_POLICY', OVERFLOW_DROP_OLDEST)
+        assert self.overflow_policy in OVERFLOW_POLICIES, \
+            'overflow_policy should be in this choices: {}'.format(OVERFLOW_POLICIES)
+        if timeout is None:
+            timeout = getattr(settings, 'SIGNAL_NOTIFICATION_BUFFER_TIMEOUT', DEFAULT_BUFFER_TIMEOUT)
+        self.timeout = timeout
+        self.spill_dir = spill_dir or getattr(settings, 'SIGNAL_NOTIFICATION_BUFFER_SPILL_DIR', None) or \
+            tempfile.gettempdir()
+        self.spill_size = spill_size or getattr(settings, 'SIGNAL_NOTIFICATION_BUFFER_SPILL_SIZE', DEFAULT_SPILL_SIZE)
+        # the spill file is created on first use, by the process which uses it
+        self._spill = None
+        self._spill_pid = None
+        self._records = deque()
+        self._cond = condition or threading.Condition()
+        self.accepted = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.spilled = 0
+        self.pickle_errors = 0
+        self._closed = False
+
+    def __len__(self):
+        return len(self._records) + (self._spill.count if self._spill else 0)
+
+    def full(self):
+        with self._cond:
+            return len(self._records) >= self.capacity
+
+    def put(self, record):
+        """Add a record to the buffer. Return False if the record was dropped"""
+        with self._cond:
+            if self._closed:
+                self.dropped_newest += 1
+                return False
+            self._release_inherited_spill()
+            if self._spill is not None and self._spill.count:
+                # keep FIFO order: nothing bypasses the records already spilled
+                return self._spill_record(record)
+            if len(self._records) >= self.capacity:
+                if self.overflow_policy == OVERFLOW_DROP_NEWEST:
+                    self.dropped_newest += 1
+                    return False
+                if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+                    self._records.popleft()
+                    self.dropped_oldest += 1
+                elif self.overflow_policy == OVERFLOW_SPILL:
+                    return self._spill_record(record)
+                elif not self._cond.wait_for(lambda: len(self._records) < self.capacity, self.timeout):
+                    self.dropped_newest += 1
+                    return False
+            self._records.append(record)
+            self.accepted += 1
+            self._cond.notify_all()
+            return True
+
+    def peek(self):
+        with self._cond:
+            self._drain_spill()
+            return self._records[0] if self._records else None
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the oldest record, or None if nothing is available within the timeout"""
+        with self._cond:
+            self._drain_spill()
+            if block and not self._records:
+                self._cond.wait_for(lambda: self._records or (self._spill and self._spill.count), timeout)
+                self._drain_spill()
+            if not self._records:
+                return None
+            record = self._records.popleft()
+            self._drain_spill()
+            self._cond.notify_all()
+            return record
+
+    def stats(self):
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'overflow_policy': self.overflow_policy,
+                'size': len(self._records),
+                'spill_size': self._spill.count if self._spill else 0,
+                'accepted': self.accepted,
+                'dropped_oldest': self.dropped_oldest,
+                'dropped_newest': self.dropped_newest,
+                'spilled': self.spilled,
+                'pickle_errors': self.pickle_errors,
+            }
+
+    def close(self):
+        """Discard the buffered records and remove the spill file. Records put afterwards are dropped"""
+        with self._cond:
+            self._closed = True
+            self._records.clear()
+            if self._spill is not None:
+                self._spill.close()
+                self._spill = None
+
+    def _release_inherited_spill(self):
+        if self._spill is not None and self._spill_pid != os.getpid():
+            # inherited through a fork: the file and its records belong to the parent process
+            self._spill = None
+
+    def _spill_record(self, record):
+        if self._spill is None:
+            self._spill = SpillFile(self.spill_dir, self.spill_size)
+            self._spill_pid = os.getpid()
+        try:
+            data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            self.pickle_errors += 1
+            return False
+        if not self._spill.append(data):
+            self.dropped_newest += 1
+            return False
+        self.spilled += 1
+        self.accepted += 1
+        self._cond.notify_all()
+        return True
+
+    def _drain_spill(self):
+        self._release_inherited_spill()
+        if self._spill is None:
+            return
+        while self._spill.count and len(self._records) < self.capacity:
+            try:
+                record = pickle.loads(self._spill.pop())
+            except Exception:
+                # pickled fine but can't be loaded back (e.g. a custom exception class), drop it
+                self.pickle_errors += 1
+                continue
+            self._records.append(record)
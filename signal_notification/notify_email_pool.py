@@ -0,0 +1,158 @@
+import atexit
+import smtplib
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+from signal_notification import NotificationException
+
+DEFAULT_POOL_MAX_SIZE = 4
+DEFAULT_POOL_IDLE_TIMEOUT = 60
+RECONNECT_EXCEPTIONS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+_email_connection_pool = None
+
+
+def get_email_connection_pool():
+    """Return the shared EmailConnectionPool, or None if SIGNAL_NOTIFICATION_EMAIL_POOL is not enabled"""
+    global _email_connection_pool
+    if _email_connection_pool is None and getattr(settings, 'SIGNAL_NOTIFICATION_EMAIL_POOL', False):
+        _email_connection_pool = EmailConnectionPool(
+            max_size=getattr(settings, 'SIGNAL_NOTIFICATION_EMAIL_POOL_MAX_SIZE', DEFAULT_POOL_MAX_SIZE),
+            idle_timeout=getattr(settings, 'SIGNAL_NOTIFICATION_EMAIL_POOL_IDLE_TIMEOUT', DEFAULT_POOL_IDLE_TIMEOUT),
+        )
+        atexit.register(_email_connection_pool.close)
+    return _email_connection_pool
+
+
+class EmailConnectionPool(object):
+    """Thread-safe pool of open django email backend connections.
+
+    At most `max_size` connections are open at the same time. An idle connection is closed once it was not used for
+    `idle_timeout` seconds, and is checked with an SMTP NOOP before it is handed out again.
+    """
+
+    def __init__(self, max_size=DEFAULT_POOL_MAX_SIZE, idle_timeout=DEFAULT_POOL_IDLE_TIMEOUT, backend=None,
+                 **backend_kwargs):
+        assert max_size > 0, 'max_size should be positive'
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.backend = backend
+        self.backend_kwargs = backend_kwargs
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle_size(self):
+        return len(self._idle)
+
+    def acquire(self, timeout=None):
+        """Return an open connection, waiting up to `timeout` seconds if `max_size` connections are in use"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            expired = []
+            try:
+                with self._cond:
+                    if self._closed:
+                        raise NotificationException('Email connection pool is closed')
+                    connection = self._pop_idle(expired)
+                    if connection is None:
+                        if self._size < self.max_size:
+                            self._size += 1
+                            break
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise NotificationException('Timed out waiting for an email connection')
+                        self._cond.wait(remaining)
+                        continue
+            finally:
+                # close the expired connections (an SMTP QUIT round trip) outside the lock
+                for expired_connection in expired:
+                    self._close(expired_connection)
+            # health check outside the lock, a dead connection is replaced
+            if self._is_alive(connection):
+                return connection
+            self._discard(connection)
+
+        try:
+            connection = get_connection(self.backend, fail_silently=False, **self.backend_kwargs)
+            connection.open()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        return connection
+
+    def release(self, connection, broken=False):
+        """Give back a connection. A broken connection is closed instead of being reused"""
+        with self._cond:
+            if not broken and not self._closed:
+                self._idle.append((time.monotonic(), connection))
+                self._cond.notify()
+                return
+        self._discard(connection)
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        except BaseException:
+            self.release(connection, broken=True)
+            raise
+        self.release(connection)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, deque()
+        for _, connection in idle:
+            self._discard(connection)
+
+    def _pop_idle(self, expired):
+        """Return the most recently used idle connection, moving the expired ones to `expired` for the caller to
+        close. Called with the lock held
+        """
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][0] >= self.idle_timeout:
+            expired.append(self._idle.popleft()[1])
+            self._size -= 1
+        if not self._idle:
+            return None
+        return self._idle.pop()[1]
+
+    @staticmethod
+    def _is_alive(connection):
+        smtp = getattr(connection, 'connection', None)
+        if smtp is None:
+            # not an smtp backend, nothing to check
+            return True
+        try:
+            return smtp.noop()[0] == 250
+        except Exception:
+            return False
+
+    def _discard(self, connection):
+        self._close(connection)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
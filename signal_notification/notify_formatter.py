@@ -0,0 +1,140 @@
+import re
+
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe, SafeData
+from django.utils.text import capfirst
+
+from signal_notification import InvalidMessageTemplateException
+
+TEMPLATE_ENGINE_DJANGO = 'django'
+TEMPLATE_ENGINE_FAST = 'fast'
+TEMPLATE_ENGINES = (TEMPLATE_ENGINE_DJANGO, TEMPLATE_ENGINE_FAST)
+
+_VARIABLE_RE = re.compile(r'{{\s*(.*?)\s*}}')
+_FILTER_RE = re.compile(r'^(\w+)(?::("[^"]*"|\'[^\']*\'|[\w.+-]+))?$')
+_PATH_RE = re.compile(r'^\w+(\.\w+)*$')
+
+
+def _filter_default(value, arg):
+    return value or arg
+
+
+def _filter_length(value, arg):
+    try:
+        return len(value)
+    except (ValueError, TypeError):
+        return 0
+
+
+FILTERS = {
+    'upper': lambda value, arg: str(value).upper(),
+    'lower': lambda value, arg: str(value).lower(),
+    'title': lambda value, arg: str(value).title(),
+    'capfirst': lambda value, arg: capfirst(str(value)),
+    'default': _filter_default,
+    'length': _filter_length,
+    'safe': lambda value, arg: mark_safe(value),
+    'escape': lambda value, arg: conditional_escape(value),
+}
+
+
+def _compile_path(path):
+    """Compile a dotted path to a function resolving it like django template variables"""
+    bits = path.split('.')
+    if not _PATH_RE.match(path) or any(bit.startswith('_') for bit in bits):
+        raise InvalidMessageTemplateException('Invalid variable: "{}"'.format(path))
+
+    def resolve(context):
+        value = context
+        for bit in bits:
+            try:
+                value = value[bit]
+            except (TypeError, AttributeError, KeyError, ValueError, IndexError):
+                try:
+                    value = getattr(value, bit)
+                except AttributeError:
+                    try:
+                        value = value[int(bit)]
+                    except (IndexError, ValueError, KeyError, TypeError):
+                        return ''
+            if callable(value) and not getattr(value, 'do_not_call_in_templates', False):
+                if getattr(value, 'alters_data', False):
+                    # like django, never call methods which change data (e.g. model delete/save)
+                    return ''
+                try:
+                    value = value()
+                except TypeError:
+                    return ''
+        return value
+
+    return resolve
+
+
+def _compile_filter_arg(arg):
+    if arg is None:
+        return lambda context: None
+    if arg[0] in '"\'':
+        # like django, string literals in templates are safe
+        literal = mark_safe(arg[1:-1])
+        return lambda context: literal
+    try:
+        number = int(arg)
+    except ValueError:
+        try:
+            number = float(arg)
+        except ValueError:
+            return _compile_path(arg)
+    return lambda context: number
+
+
+def _compile_variable(expression):
+    bits = [b.strip() for b in expression.split('|')]
+    resolve = _compile_path(bits[0])
+    filters = []
+    for bit in bits[1:]:
+        match = _FILTER_RE.match(bit)
+        if not match or match.group(1) not in FILTERS:
+            raise InvalidMessageTemplateException('Invalid filter: "{}"'.format(bit))
+        filters.append((FILTERS[match.group(1)], _compile_filter_arg(match.group(2))))
+
+    def render(context):
+        value = resolve(context)
+        for filter_func, arg in filters:
+            value = filter_func(value, arg(context))
+        if isinstance(value, SafeData):
+            return value
+        return conditional_escape(str(value))
+
+    return render
+
+
+def compile_template(template_string):
+    """Compile a message template to a `render(context)` function.
+
+    Supports `{{ dotted.path }}` variables, resolved like django template variables and html escaped, with
+    these filters: upper, lower, title, capfirst, default, length, safe, escape.
+    Template tags (`{% ... %}`) are not supported.
+    """
+    template_string = template_string or ''
+    if '{%' in template_string or '{#' in template_string:
+        raise InvalidMessageTemplateException('Template tags and comments are not supported by the fast engine')
+    parts = []
+    pos = 0
+    for match in _VARIABLE_RE.finditer(template_string):
+        if match.start() > pos:
+            parts.append(template_string[pos:match.start()])
+        parts.append(_compile_variable(match.group(1)))
+        pos = match.end()
+    if pos < len(template_string):
+        parts.append(template_string[pos:])
+
+    if not parts:
+        return lambda context: ''
+    if len(parts) == 1 and isinstance(parts[0], str):
+        text = parts[0]
+        return lambda context: text
+
+    def render(context):
+        return ''.join([p if isinstance(p, str) else p(context) for p in parts])
+
+    return render
@@ -1,3 +1,4 @@
+import functools
 from collections import OrderedDict
 
 from django.conf import settings
@@ -8,7 +9,10 @@ from django.template.loader import render_to_string
 from django.utils.module_loading import import_string
 
 from signal_notification import UnknownNotificationHandlerException
-from signal_notification.notify_media import NotifyMedia
+from signal_notification.notify_formatter import compile_template, TEMPLATE_ENGINE_DJANGO, TEMPLATE_ENGINE_FAST
+from signal_notification.notify_media import NotifyMedia, send_hedged, get_registered_medias
+from signal_notification.notify_profiler import profile_stage, bind_profile_event
+from signal_notification.notify_scheduler import PRIORITY_NORMAL, PRIORITY_LOW, PRIORITY_HIGH
 
 _registered_handlers = None
 
@@ -43,6 +47,10 @@ class NotifyHandler(object):
     signal = None
     signal_receiver = None
     signal_sender = None
+    priority = PRIORITY_NORMAL  # can be overridden per NotificationSetting
+    # engine of subject_template and message_template fields: "django" or "fast" (see notify_formatter)
+    template_engine = TEMPLATE_ENGINE_DJANGO
+    media_template_engines = None  # {media_name: engine} to override the engine per media
 
     def __init__(self, notification_setting):
         assert notification_setting is not None, 'notification_setting cannot be None'
@@ -60,37 +68,73 @@ class NotifyHandler(object):
         cls.signal_receiver = signal_receiver
         cls.signal.connect(cls.signal_handler, sender=cls.signal_sender)
 
-    @property
-    def message_template_path(self):
-        templates = self.MESSAGE_TEMPLATE_PATH_PATTERNS
+    @staticmethod
+    def _get_template_paths(templates, notification, media):
         if isinstance(templates, str):
             templates = [templates]
 
-        return [t.format(notification=self.name, media=self.notification_setting.media_name) for t in templates]
+        return [t.format(notification=notification, media=media) for t in templates]
+
+    def get_message_template_path(self, media_name=None):
+        return self._get_template_paths(self.MESSAGE_TEMPLATE_PATH_PATTERNS, self.name,
+                                        media_name or self.notification_setting.media_name)
+
+    def get_subject_template_path(self, media_name=None):
+        return self._get_template_paths(self.SUBJECT_TEMPLATE_PATH_PATTERNS, self.name,
+                                        media_name or self.notification_setting.media_name)
+
+    @property
+    def message_template_path(self):
+        return self.get_message_template_path()
 
     @property
     def subject_template_path(self):
-        templates = self.SUBJECT_TEMPLATE_PATH_PATTERNS
-        if isinstance(templates, str):
-            templates = [templates]
+        return self.get_subject_template_path()
 
-        return [t.format(notification=self.name, media=self.notification_setting.media_name) for t in templates]
+    def get_template_engine(self, media_name=None):
+        """Return the engine of subject_template and message_template fields for the media"""
+        media_name = media_name or self.notification_setting.media_name
+        engine = (self.media_template_engines or {}).get(media_name)
+        if engine is None:
+            media_cls = get_registered_medias().get(media_name)
+            engine = getattr(media_cls, 'template_engine', None)
+        return engine or self.template_engine
 
-    def get_rendered_subject(self, context):
+    @classmethod
+    def get_compiled_template(cls, template_string):
+        """Return the fast engine render function of template_string, compiled once per handler class"""
+        compiled_templates = cls.__dict__.get('_compiled_templates')
+        if compiled_templates is None:
+            cls._compiled_templates = compiled_templates = {}
+        render = compiled_templates.get(template_string)
+        if render is None:
+            compiled_templates[template_string] = render = compile_template(template_string)
+        return render
+
+    def render_template(self, template_string, context, media_name=None):
+        if self.get_template_engine(media_name) == TEMPLATE_ENGINE_FAST:
+            return self.get_compiled_template(template_string or '')(context)
+        t = Template(template_string or '')
+        return t.render(Context(context))
+
+    def get_rendered_subject(self, context, media_name=None):
         try:
-            return render_to_string(self.subject_template_path, context)
+            return render_to_string(self.get_subject_template_path(media_name), context)
         except TemplateDoesNotExist:
-            t = Template(self.subject_template or '')
-            return t.render(Context(context))
+            return self.render_template(self.subject_template, context, media_name)
 
-    def get_rendered_message(self, context):
+    def get_rendered_message(self, context, media_name=None):
         try:
-            return render_to_string(self.message_template_path, context)
+            return render_to_string(self.get_message_template_path(media_name), context)
         except TemplateDoesNotExist as e:
             if not self.message_template:
                 raise e
-            t = Template(self.message_template or '')
-            return t.render(Context(context))
+            return self.render_template(self.message_template, context, media_name)
+
+    def get_priority(self):
+        if self.notification_setting.priority is not None:
+            return self.notification_setting.priority
+        return self.priority
 
     def is_triggered(self, notification_args):
         # TODO: we should process the rules here!
@@ -99,13 +143,43 @@ class NotifyHandler(object):
     def get_template_context(self, notification_args):
         return notification_args
 
+    def send(self, media_name, media_params, context):
+        media_cls = NotifyMedia.get_class_by_name(media_name)
+        # media params are validated when the notification setting is saved
+        media = media_cls(validate=False, **(media_params or {}))
+        with profile_stage('render_subject'):
+            subject = self.get_rendered_subject(context, media_name)
+        with profile_stage('render_message'):
+            message = self.get_rendered_message(context, media_name)
+        with profile_stage('send.{}'.format(media_name)):
+            return media.send(message, subject)
+
+    def get_media_steps(self):
+        """Return the ordered `(media_name, media_params, latency_budget)` steps of the notification setting"""
+        ns = self.notification_setting
+        steps = [(ns.media_name, ns.media_params, ns.latency_budget)]
+        for step in ns.media_chain or []:
+            steps.append((step['media_name'], step.get('media_params'), step.get('latency_budget')))
+        return steps
+
     def handle(self, notification_args):
-        media_cls = NotifyMedia.get_class_by_name(self.notification_setting.media_name)
-        media = media_cls(**(self.notification_setting.media_params or {}))
-        context = self.get_template_context(notification_args)
-        subject = self.get_rendered_subject(context)
-        message = self.get_rendered_message(context)
-        media.send(message, subject)
+        with profile_stage('template_context'):
+            context = self.get_template_context(notification_args)
+        self.deliver(context)
+
+    def deliver(self, context):
+        """Render and send the notification for an already built template context"""
+        steps = self.get_media_steps()
+        if len(steps) == 1:
+            media_name, media_params, _ = steps[0]
+            self.send(media_name, media_params, context)
+            return
+        media_name, _, elapsed = send_hedged([
+            (media_name, latency_budget,
+             bind_profile_event(functools.partial(self.send, media_name, media_params, context)))
+            for media_name, media_params, latency_budget in steps
+        ])
+        print('+++ Notified by "{}" media in {:.3f}s'.format(media_name, elapsed))
 
     @staticmethod
     def get_class_by_name(name):
@@ -120,6 +194,7 @@ class UserLoggedInHandler(NotifyHandler):
 
     signal = user_logged_in
     name = 'user_logged_in'
+    priority = PRIORITY_LOW
     subject_template = 'New Login'
     message_template = 'User "{{user}}" Logged In.'
 
@@ -142,6 +217,7 @@ class UserLoginFailedHandler(NotifyHandler):
 
     signal = user_login_failed
     name = 'user_login_failed'
+    priority = PRIORITY_HIGH
     subject_template = 'Login Failed'
     message_template = 'Failed login for "{{credentials.username}}" username! Remote ip: {{remote_ip}}'
 
@@ -1,10 +1,17 @@
+import atexit
+import os
+import threading
 import traceback
 
 from django.conf import settings
+from django.db import close_old_connections
 from django.db.models import Q
 from django.utils.module_loading import import_string
 
-from .notify_handlers import get_registered_handlers
+from .notify_buffer import EventRecord, picklable_context
+from .notify_handlers import get_registered_handlers, NotifyHandler
+from .notify_profiler import profile_event, profile_stage
+from .notify_scheduler import PriorityScheduler
 
 
 class NotifyManager(object):
@@ -38,20 +45,24 @@ class NotifyManager(object):
         return cls._handle_notification(handler_cls, notification_args)
 
     @staticmethod
-    def _handle_notification(handler_cls, notification_args):
+    def get_notification_settings(handler_cls):
         from .models import NotificationSetting
 
-        notification_name = handler_cls.name
+        return NotificationSetting.objects.filter(
+            Q(notification_name=handler_cls.name) | Q(notification_name__isnull=True)).filter(enabled=True)
 
-        notification_settings = NotificationSetting.objects.filter(
-            Q(notification_name=notification_name) | Q(notification_name__isnull=True)).filter(enabled=True)
+    @classmethod
+    def _handle_notification(cls, handler_cls, notification_args):
+        for ns in cls.get_notification_settings(handler_cls):
+            cls._handle_notification_setting(handler_cls(ns), notification_args)
 
-        for ns in notification_settings:
-            print("+++ Handling Notification Setting #{}".format(ns.pk))
-            handler = handler_cls(ns)
+    @staticmethod
+    def _handle_notification_setting(handler, notification_args):
+        print("+++ Handling Notification Setting #{}".format(handler.notification_setting.pk))
+        with profile_event(handler):
             if not handler.is_triggered(notification_args):
                 print("!!! Not triggering notification: {}".format(notification_args))
-                continue
+                return
             try:
                 print("***** Running handler: {}".format(handler))
                 handler.handle(notification_args)
@@ -59,6 +70,119 @@ class NotifyManager(object):
                 traceback.print_exc()
 
 
+class PriorityNotifyManager(NotifyManager):
+    """Deliver notifications from background worker threads in priority order.
+
+    Every matching NotificationSetting is queued with its own priority (see NotifyHandler.get_priority), so high
+    priority notifications are not delayed behind low priority ones when the workers are saturated.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.scheduler = None
+        self.workers = []
+        self._pid = None
+        self._start_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+        if not getattr(settings, 'SIGNAL_NOTIFICATION_DISABLED', False):
+            atexit.register(self.shutdown)
+
+    def get_scheduler(self):
+        """Return the scheduler of the current process, creating it and starting its workers on first use.
+
+        Workers are not started at import time: management commands don't need them, and threads don't survive a
+        fork of preforking servers, so every (forked) process starts its own on its first notification.
+        """
+        if self._pid != os.getpid():
+            with self._start_lock:
+                if self._pid != os.getpid():
+                    # anything inherited from the parent process is left to the parent
+                    self.scheduler = PriorityScheduler()
+                    self.workers = []
+                    self.start_workers(getattr(settings, 'SIGNAL_NOTIFICATION_SCHEDULER_WORKERS', 2))
+                    self._pid = os.getpid()
+        return self.scheduler
+
+    def start_workers(self, count):
+        for i in range(count):
+            worker = threading.Thread(target=self.run_worker, args=(self.scheduler,),
+                                      name='signal-notification-worker-{}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def shutdown(self, timeout=None):
+        """Stop the workers, waiting up to `timeout` seconds for each running notification, then close the buffers"""
+        if self._pid != os.getpid():
+            # nothing was started in this process
+            return
+        if timeout is None:
+            timeout = getattr(settings, 'SIGNAL_NOTIFICATION_SCHEDULER_SHUTDOWN_TIMEOUT', 5)
+        self.scheduler.stop()
+        for worker in self.workers:
+            worker.join(timeout)
+        alive = sum(1 for w in self.workers if w.is_alive())
+        if alive:
+            print("!!! {} notification workers did not stop in time".format(alive))
+        discarded = self.scheduler.close()
+        if discarded:
+            print("!!! Discarded {} queued notifications on shutdown".format(discarded))
+
+    def run_worker(self, scheduler):
+        while True:
+            try:
+                record = scheduler.get()
+                if record is None:
+                    break
+                self._handle_event_record(record)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                close_old_connections()
+
+    @staticmethod
+    def _handle_event_record(record):
+        from .models import NotificationSetting
+
+        ns = NotificationSetting.objects.filter(pk=record.setting_id, enabled=True).first()
+        if ns is None:
+            return
+        handler = NotifyHandler.get_class_by_name(record.handler_name)(ns)
+        with profile_event(handler):
+            print("***** Running handler: {}".format(handler))
+            handler.deliver(record.context)
+
+    @classmethod
+    def handle_notification(cls, handler_cls, notification_args):
+        """Queue the notification of every matching setting.
+
+        The trigger check and the template context are done here, while values like `request` are still available.
+        Only the picklable part of the context is queued, so the record can be spilled to disk.
+        """
+        scheduler = cls.get_instance().get_scheduler()
+        for ns in cls.get_notification_settings(handler_cls):
+            # never let a notification break the code which sent the signal
+            try:
+                handler = handler_cls(ns)
+                with profile_event(handler, total_stage='enqueue'):
+                    if not handler.is_triggered(notification_args):
+                        print("!!! Not triggering notification: {}".format(notification_args))
+                        continue
+                    with profile_stage('template_context'):
+                        context = picklable_context(handler.get_template_context(notification_args))
+                    record = EventRecord(handler_cls.name, ns.pk, handler.get_priority(), context)
+                    if not scheduler.put(record):
+                        print("!!! Dropped notification: {}".format(record))
+            except Exception:
+                traceback.print_exc()
+
+    def get_stats(self):
+        scheduler = self.get_scheduler()
+        return {
+            'workers': len(self.workers),
+            'buffers': scheduler.stats(),
+        }
+
+
 def get_registered_notify_manager():
     manager_cls = getattr(settings, 'SIGNAL_NOTIFICATION_MANAGER_CLASS', None) or NotifyManager
     if isinstance(manager_cls, str):
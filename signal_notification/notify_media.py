@@ -1,11 +1,17 @@
+import itertools
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 from cerberus import Validator
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import get_connection, EmailMultiAlternatives
+from django.db import connection
 from django.utils.module_loading import import_string
 
-from signal_notification import UnknownNotificationMediaException, InvalidNotificationMediaArgsException
+from signal_notification import NotificationException, UnknownNotificationMediaException, \
+    InvalidNotificationMediaArgsException
+from signal_notification.notify_email_pool import get_email_connection_pool, RECONNECT_EXCEPTIONS
 
 _registered_medias = None
 EMAIL_SCHEMA = {
@@ -20,15 +26,48 @@ SCHEMA_LIST_OF_EMAILS = {
     },
 }
 
+PHONE_NUMBER_SCHEMA = {'type': 'string', }
 SCHEMA_LIST_OF_PHONE_NUMBERS = {
     'type': 'list', 'empty': False, 'required': True,
-    'schema': {'type': 'string', },
+    'schema': PHONE_NUMBER_SCHEMA,
     'meta': {
         'caption': 'To Recipients',
         'item_caption': 'To',
     },
 }
 
+RECIPIENT_KIND_EMAIL = 'email'
+RECIPIENT_KIND_PHONE = 'phone'
+RECIPIENT_KIND_CHOICES = (
+    (RECIPIENT_KIND_EMAIL, 'Email'),
+    (RECIPIENT_KIND_PHONE, 'Phone Number'),
+)
+RECIPIENT_ADDRESS_SCHEMAS = {
+    RECIPIENT_KIND_EMAIL: EMAIL_SCHEMA,
+    RECIPIENT_KIND_PHONE: PHONE_NUMBER_SCHEMA,
+}
+SCHEMA_RECIPIENT_GROUPS = {
+    'type': 'list', 'empty': False,
+    'schema': {'type': 'string', 'empty': False},
+    'meta': {
+        'caption': 'Recipient Groups',
+        'item_caption': 'Recipient Group Name',
+    },
+}
+DEFAULT_RECIPIENT_CHUNK_SIZE = 100
+
+SCHEMA_MEDIA_CHAIN = {
+    'type': 'list', 'nullable': True,
+    'schema': {
+        'type': 'dict',
+        'schema': {
+            'media_name': {'type': 'string', 'required': True, 'empty': False},
+            'media_params': {'type': 'dict', 'nullable': True},
+            'latency_budget': {'type': 'number', 'nullable': True, 'min': 0},
+        },
+    },
+}
+
 
 def get_registered_medias():
     global _registered_medias
@@ -50,9 +89,11 @@ def get_registered_medias():
 class NotifyMedia(object):
     name = None
     PARAMS_SCHEMA_VALIDATOR = None
+    template_engine = None  # set to override the template engine of handlers for this media
 
-    def __init__(self, **kwargs):
-        self.kwargs = self.validate_args(kwargs)
+    def __init__(self, validate=True, **kwargs):
+        """`validate=False` skips validation of args which are already validated, like saved media_params"""
+        self.kwargs = self.validate_args(kwargs) if validate else kwargs
 
     @classmethod
     def validate_args(cls, kwargs):
@@ -76,39 +117,115 @@ class NotifyMedia(object):
         return media_cls
 
 
-class EmailMedia(NotifyMedia):
+class RecipientsMedia(NotifyMedia):
+    """Base class of medias which send to a list of inline `recipients` and/or named `recipient_groups`"""
+    RECIPIENT_KIND = None
+
+    @classmethod
+    def validate_args(cls, kwargs):
+        kwargs = super().validate_args(kwargs)
+        if not kwargs.get('recipients') and not kwargs.get('recipient_groups'):
+            raise InvalidNotificationMediaArgsException(
+                'Invalid Media Params', {'recipients': ['recipients or recipient_groups is required']})
+        if kwargs.get('recipient_groups'):
+            from signal_notification.models import RecipientGroup
+
+            groups = set(kwargs['recipient_groups'])
+            existing = set(RecipientGroup.objects.filter(
+                name__in=groups, kind=cls.RECIPIENT_KIND).values_list('name', flat=True))
+            missing = sorted(groups - existing)
+            if missing:
+                raise InvalidNotificationMediaArgsException('Invalid Media Params', {
+                    'recipient_groups': ['No {} recipient group: {}'.format(cls.RECIPIENT_KIND, missing)]
+                })
+        return kwargs
+
+    def iter_recipient_chunks(self, chunk_size=None):
+        """Yield `(recipients, from_group)` of at most `chunk_size` recipients, inline recipients first, then the
+        recipient groups streamed from database. Raise NotificationException if there is no recipient at all.
+        """
+        chunk_size = chunk_size or getattr(
+            settings, 'SIGNAL_NOTIFICATION_RECIPIENT_CHUNK_SIZE', DEFAULT_RECIPIENT_CHUNK_SIZE)
+        recipients = self.kwargs.get('recipients') or []
+        if isinstance(recipients, str):
+            recipients = [recipients]
+        sources = [(recipients, False)]
+        if self.kwargs.get('recipient_groups'):
+            from signal_notification.models import Recipient
+
+            group_recipients = Recipient.objects.filter(
+                group__name__in=self.kwargs['recipient_groups']
+            ).order_by('address').values_list('address', flat=True).distinct().iterator(chunk_size=chunk_size)
+            sources.append((group_recipients, True))
+
+        found = False
+        for source, from_group in sources:
+            source = iter(source)
+            while True:
+                chunk = list(itertools.islice(source, chunk_size))
+                if not chunk:
+                    break
+                found = True
+                yield chunk, from_group
+        if not found:
+            raise NotificationException('No recipients for "{}" media'.format(self.name))
+
+
+class EmailMedia(RecipientsMedia):
+    """Send an email per chunk of recipients. Recipients of groups are sent as Bcc, so they don't see each other"""
     name = 'email'
+    RECIPIENT_KIND = RECIPIENT_KIND_EMAIL
     PARAMS_SCHEMA_VALIDATOR = {
-        'recipients': SCHEMA_LIST_OF_EMAILS
+        'recipients': dict(SCHEMA_LIST_OF_EMAILS, required=False),
+        'recipient_groups': SCHEMA_RECIPIENT_GROUPS,
     }
 
     def send(self, message, subject=None):
         from_email = settings.DEFAULT_EMAIL_FROM
-        recipients = self.kwargs['recipients']
-        if isinstance(recipients, str):
-            recipients = [recipients]
-        else:
-            recipients = list(recipients)
-        return send_mail(subject, message, from_email, recipients, html_message=message,
-                         fail_silently=False)
+        pool = get_email_connection_pool()
+        if pool is None:
+            # share one connection between all chunks
+            with get_connection(fail_silently=False) as connection:
+                return sum(
+                    self._send_chunk(connection, subject, message, from_email, recipients, bcc)
+                    for recipients, bcc in self.iter_recipient_chunks()
+                )
+        return sum(self._send_pooled(pool, subject, message, from_email, recipients, bcc)
+                   for recipients, bcc in self.iter_recipient_chunks())
 
+    @staticmethod
+    def _send_chunk(connection, subject, message, from_email, recipients, bcc=False):
+        mail = EmailMultiAlternatives(subject, message, from_email, to=None if bcc else recipients,
+                                      bcc=recipients if bcc else None, connection=connection)
+        mail.attach_alternative(message, 'text/html')
+        return mail.send()
 
-class SMSMedia(NotifyMedia):
+    @classmethod
+    def _send_pooled(cls, pool, subject, message, from_email, recipients, bcc=False):
+        try:
+            with pool.connection() as connection:
+                return cls._send_chunk(connection, subject, message, from_email, recipients, bcc)
+        except RECONNECT_EXCEPTIONS:
+            # the pooled connection was dropped by the server, retry once on a new connection
+            with pool.connection() as connection:
+                return cls._send_chunk(connection, subject, message, from_email, recipients, bcc)
+
+
+class SMSMedia(RecipientsMedia):
     name = 'sms'
+    RECIPIENT_KIND = RECIPIENT_KIND_PHONE
     PARAMS_SCHEMA_VALIDATOR = {
-        'recipients': SCHEMA_LIST_OF_PHONE_NUMBERS
+        'recipients': dict(SCHEMA_LIST_OF_PHONE_NUMBERS, required=False),
+        'recipient_groups': SCHEMA_RECIPIENT_GROUPS,
     }
 
     def send(self, message, subject=None):
         from sendsms import api
         from_ = settings.SMS_DEFAULT_FROM_PHONE
-        recipients = self.kwargs['recipients']
-        if isinstance(recipients, str):
-            recipients = [recipients]
-        else:
-            recipients = list(recipients)
-
-        return api.send_sms(body=message, from_phone=from_, to=recipients, fail_silently=False)
+        sent = 0
+        for recipients, _ in self.iter_recipient_chunks():
+            sent += api.send_sms(body=message, from_phone=from_, to=recipients, fail_silently=False) or 0
+        return sent
 
 
 class RocketchatMedia(NotifyMedia):
@@ -132,6 +249,72 @@ class RocketchatMedia(NotifyMedia):
             )
 
 
+def validate_media_chain(media_chain):
+    """Validate a list of fallback media steps and the params of each step's media"""
+    v = Validator({'media_chain': SCHEMA_MEDIA_CHAIN})
+    if not v.validate({'media_chain': media_chain}):
+        raise InvalidNotificationMediaArgsException('Invalid Media Chain', v.errors)
+    media_chain = v.document['media_chain'] or []
+    for i, step in enumerate(media_chain):
+        media_cls = get_registered_medias().get(step['media_name'])
+        if not media_cls:
+            raise InvalidNotificationMediaArgsException(
+                'Invalid Media Chain', {i: 'No Media Notification: "{}"'.format(step['media_name'])})
+        try:
+            step['media_params'] = media_cls.validate_args(step.get('media_params'))
+        except InvalidNotificationMediaArgsException as e:
+            raise InvalidNotificationMediaArgsException('Invalid Media Chain', {i: e.args[1]})
+    return media_chain
+
+
+def _run_send_step(send):
+    try:
+        return send()
+    finally:
+        connection.close()
+
+
+def send_hedged(steps):
+    """Send through an ordered list of `(media_name, latency_budget, send)` steps and return the first success.
+
+    The first step is started immediately. When the latest started step fails, or has not succeeded within its
+    latency budget (seconds, None means no limit), the next step is started while the earlier ones keep running.
+    Returns `(media_name, result, elapsed_seconds)` of the first successful step, or raises the last error if
+    all of them failed. Steps still running after the first success are not cancelled.
+    """
+    assert steps, 'at least one step is required'
+    start = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=len(steps))
+    pending = {}
+    next_step = 0
+    deadline = None
+    last_error = None
+    try:
+        while pending or next_step < len(steps):
+            if next_step < len(steps) and (not pending or (deadline is not None and time.monotonic() >= deadline)):
+                media_name, budget, send = steps[next_step]
+                pending[executor.submit(_run_send_step, send)] = media_name
+                deadline = None if budget is None else time.monotonic() + budget
+                next_step += 1
+            timeout = None
+            if next_step < len(steps) and deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                media_name = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print('!!! Failed to send by "{}" media: {!r}'.format(media_name, e))
+                    last_error = e
+                    deadline = time.monotonic()  # start the next step right away
+                    continue
+                return media_name, result, time.monotonic() - start
+        raise last_error
+    finally:
+        executor.shutdown(wait=False)
+
+
 DEFAULT_MEDIA_CLASSES = [
     EmailMedia, SMSMedia, RocketchatMedia
 ]
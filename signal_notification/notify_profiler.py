@@ -0,0 +1,251 @@
+import atexit
+import cProfile
+import functools
+import json
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+ENGINE_WALLCLOCK = 'wallclock'
+ENGINE_CPROFILE = 'cprofile'
+PROFILING_ENGINES = (ENGINE_WALLCLOCK, ENGINE_CPROFILE)
+
+_profiler = None
+_profiler_loaded = False
+
+
+def get_profiler():
+    """Return the NotifyProfiler, or None if SIGNAL_NOTIFICATION_PROFILING is not enabled"""
+    global _profiler, _profiler_loaded
+    if not _profiler_loaded:
+        if getattr(settings, 'SIGNAL_NOTIFICATION_PROFILING', False):
+            _profiler = NotifyProfiler(
+                sample_rate=getattr(settings, 'SIGNAL_NOTIFICATION_PROFILING_SAMPLE_RATE', 0.01),
+                engine=getattr(settings, 'SIGNAL_NOTIFICATION_PROFILING_ENGINE', ENGINE_WALLCLOCK),
+                dump_path=getattr(settings, 'SIGNAL_NOTIFICATION_PROFILING_DUMP_PATH', None),
+                dump_interval=getattr(settings, 'SIGNAL_NOTIFICATION_PROFILING_DUMP_INTERVAL', 60),
+            )
+            atexit.register(_profiler.dump)
+        _profiler_loaded = True
+    return _profiler
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+def profile_event(handler, total_stage='total'):
+    """Context manager to profile one notification event (a handler with its notification setting) if sampled.
+
+    The whole event is timed as `total_stage`.
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        return _NULL_CONTEXT
+    return profiler.event(handler, total_stage)
+
+
+def profile_stage(stage):
+    """Context manager to time a stage of the current event, if the event is being profiled"""
+    profiler = get_profiler()
+    if profiler is None or getattr(profiler.local, 'event', None) is None:
+        return _NULL_CONTEXT
+    return profiler.stage(stage)
+
+
+def bind_profile_event(func):
+    """Wrap `func` so its stages are attributed to the current event when it is called from another thread"""
+    profiler = get_profiler()
+    event = profiler and getattr(profiler.local, 'event', None)
+    if event is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler.local.event = event
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.local.event = None
+
+    return wrapper
+
+
+class _StageTimer(object):
+    __slots__ = ('profiler', 'key', 'start')
+
+    def __init__(self, profiler, key):
+        self.profiler = profiler
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.profiler.add_timing(self.key, time.perf_counter() - self.start)
+        return False
+
+
+class _EventProfile(object):
+    def __init__(self, profiler, handler, total_stage):
+        self.profiler = profiler
+        self.event = (handler.name, handler.notification_setting.pk)
+        self.total_stage = total_stage
+        self.cprofile = None
+
+    def __enter__(self):
+        profiler = self.profiler
+        profiler.local.event = self.event
+        # only one cProfile profiler can be active at a time, concurrent samples are wall-clock only
+        if profiler.engine == ENGINE_CPROFILE and profiler.cprofile_lock.acquire(False):
+            self.cprofile = cProfile.Profile()
+            try:
+                self.cprofile.enable()
+            except ValueError:
+                profiler.cprofile_lock.release()
+                self.cprofile = None
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.local.event = None
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            profiler.cprofile_lock.release()
+            profiler.add_cprofile(self.event[0], self.cprofile)
+        profiler.add_timing(self.event + (self.total_stage,), elapsed)
+        profiler.maybe_dump()
+        return False
+
+
+class NotifyProfiler(object):
+    """Profile a sample of notification events.
+
+    Wall-clock time is aggregated per (handler name, notification setting id, stage). With the cProfile engine the
+    function level stats of sampled events are also aggregated per handler. Stats are written to `dump_path` (as
+    json, and `<dump_path>.<handler>.pstats` for cProfile) every `dump_interval` seconds.
+    """
+
+    def __init__(self, sample_rate=0.01, engine=ENGINE_WALLCLOCK, dump_path=None, dump_interval=60):
+        assert engine in PROFILING_ENGINES, 'engine should be in this choices: {}'.format(PROFILING_ENGINES)
+        self.sample_rate = sample_rate
+        self.engine = engine
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self.local = threading.local()
+        self.cprofile_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._cprofile_stats = {}
+        self._last_dump = time.monotonic()
+        self._dump_lock = threading.Lock()
+
+    def event(self, handler, total_stage='total'):
+        if random.random() >= self.sample_rate:
+            return _NULL_CONTEXT
+        return _EventProfile(self, handler, total_stage)
+
+    def stage(self, stage):
+        return _StageTimer(self, self.local.event + (stage,))
+
+    def add_timing(self, key, elapsed):
+        with self._lock:
+            timing = self._timings.get(key)
+            if timing is None:
+                self._timings[key] = [1, elapsed, elapsed]
+            else:
+                timing[0] += 1
+                timing[1] += elapsed
+                timing[2] = max(timing[2], elapsed)
+
+    def add_cprofile(self, handler_name, profile):
+        with self._lock:
+            stats = self._cprofile_stats.get(handler_name)
+            if stats is None:
+                self._cprofile_stats[handler_name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def get_stats(self, top_functions=20):
+        with self._lock:
+            timings = [
+                OrderedDict([
+                    ('handler', handler_name), ('setting_id', setting_id), ('stage', stage), ('count', count),
+                    ('total', total), ('avg', total / count), ('max', max_),
+                ])
+                for (handler_name, setting_id, stage), (count, total, max_) in sorted(self._timings.items())
+            ]
+            functions = OrderedDict()
+            for handler_name, stats in sorted(self._cprofile_stats.items()):
+                rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top_functions]
+                functions[handler_name] = [
+                    OrderedDict([
+                        ('function', '{}:{}({})'.format(*func)), ('calls', nc), ('tottime', tt), ('cumtime', ct),
+                    ])
+                    for func, (cc, nc, tt, ct, callers) in rows
+                ]
+        return OrderedDict([
+            ('engine', self.engine), ('sample_rate', self.sample_rate), ('stages', timings),
+            ('functions', functions),
+        ])
+
+    def maybe_dump(self):
+        if self.dump_path and time.monotonic() - self._last_dump >= self.dump_interval:
+            self.dump(blocking=False)
+
+    def dump(self, blocking=True):
+        """Write the stats to dump_path. With `blocking=False` the dump is skipped if another one is running"""
+        if not self.dump_path:
+            return
+        if not self._dump_lock.acquire(blocking):
+            return
+        try:
+            if not blocking and time.monotonic() - self._last_dump < self.dump_interval:
+                # dumped by another thread in the meantime
+                return
+            self._last_dump = time.monotonic()
+            stats = self.get_stats()
+            self._write_file(self.dump_path, lambda path: self._write_json(path, stats))
+            with self._lock:
+                # serialize in memory (the format of pstats.Stats.dump_stats), write the files after releasing the lock
+                cprofile_dumps = [(name, marshal.dumps(stats.stats)) for name, stats in self._cprofile_stats.items()]
+            for handler_name, data in cprofile_dumps:
+                self._write_file('{}.{}.pstats'.format(self.dump_path, handler_name),
+                                 functools.partial(self._write_bytes, data=data))
+        finally:
+            self._dump_lock.release()
+
+    @staticmethod
+    def _write_json(path, stats):
+        with open(path, 'w') as f:
+            json.dump(stats, f, indent=2)
+
+    @staticmethod
+    def _write_bytes(path, data):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    @staticmethod
+    def _write_file(path, write):
+        """Write a file by `write(temp_path)` and move it into place, so readers never see a partial file"""
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from signal_notification.notify_buffer import NotificationBuffer
+
+PRIORITY_LOW = 10
+PRIORITY_NORMAL = 20
+PRIORITY_HIGH = 30
+PRIORITY_CHOICES = (
+    (PRIORITY_LOW, 'Low'),
+    (PRIORITY_NORMAL, 'Normal'),
+    (PRIORITY_HIGH, 'High'),
+)
+DEFAULT_PRIORITY_WEIGHTS = {
+    PRIORITY_LOW: 1,
+    PRIORITY_NORMAL: 4,
+    PRIORITY_HIGH: 16,
+}
+DEFAULT_AGING_SECONDS = 30
+
+
+class PriorityScheduler(object):
+    """Thread-safe scheduler with one bounded NotificationBuffer per priority.
+
+    Buffers are served by smooth weighted round robin, so a saturated high priority buffer gets most of the
+    delivery slots without starving the others. A record waiting longer than `aging_seconds` at the head of its
+    buffer is promoted to the next higher priority buffer.
+    """
+
+    def __init__(self, weights=None, aging_seconds=None, spill_dir=None):
+        weights = weights or getattr(settings, 'SIGNAL_NOTIFICATION_SCHEDULER_WEIGHTS', None) or \
+            DEFAULT_PRIORITY_WEIGHTS
+        if aging_seconds is None:
+            aging_seconds = getattr(settings, 'SIGNAL_NOTIFICATION_SCHEDULER_AGING_SECONDS', DEFAULT_AGING_SECONDS)
+        assert all(w > 0 for w in weights.values()), 'Scheduler weights should be positive'
+        self.weights = OrderedDict(sorted(weights.items()))
+        self.aging_seconds = aging_seconds
+        self._cond = threading.Condition()
+        self._buffers = OrderedDict(
+            (p, NotificationBuffer(spill_dir=spill_dir, condition=self._cond)) for p in self.weights
+        )
+        self._current_weights = {p: 0 for p in self.weights}
+        self._stopped = False
+
+    def normalize_priority(self, priority):
+        """Map any priority value to the nearest configured priority not above it"""
+        if priority is None:
+            priority = PRIORITY_NORMAL
+        candidates = [p for p in self._buffers if p <= priority]
+        return candidates[-1] if candidates else next(iter(self._buffers))
+
+    def put(self, record):
+        """Queue an EventRecord by its priority. Return False if the record was dropped"""
+        record.priority = self.normalize_priority(record.priority)
+        return self._buffers[record.priority].put(record)
+
+    def get(self, block=True, timeout=None):
+        """Return the next scheduled record, or None if nothing is available within the timeout or it is stopped"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._stopped:
+                    return None
+                self._age()
+                priority = self._select_priority()
+                if priority is not None:
+                    return self._buffers[priority].get(block=False)
+                if not block:
+                    return None
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def qsize(self, priority=None):
+        with self._cond:
+            if priority is not None:
+                return len(self._buffers[self.normalize_priority(priority)])
+            return sum(len(b) for b in self._buffers.values())
+
+    def stats(self):
+        return OrderedDict((p, b.stats()) for p, b in self._buffers.items())
+
+    def stop(self):
+        """Wake up all consumers waiting in `get` and make it return None from now on"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def close(self):
+        """Close the buffers and return the number of discarded records"""
+        with self._cond:
+            discarded = sum(len(b) for b in self._buffers.values())
+            for b in self._buffers.values():
+                b.close()
+        return discarded
+
+    def _age(self):
+        if not self.aging_seconds:
+            return
+        now = time.monotonic()
+        priorities = list(self._buffers)
+        for lower, higher in zip(priorities, priorities[1:]):
+            source, target = self._buffers[lower], self._buffers[higher]
+            while not target.full():
+                record = source.peek()
+                if record is None or now - record.created < self.aging_seconds:
+                    break
+                source.get(block=False)
+                record.priority, record.created = higher, now
+                target.put(record)
+
+    def _select_priority(self):
+        active = [p for p, b in self._buffers.items() if len(b)]
+        for p in self._buffers:
+            if p not in active:
+                self._current_weights[p] = 0
+        if not active:
+            return None
+        total = 0
+        for p in active:
+            self._current_weights[p] += self.weights[p]
+            total += self.weights[p]
+        selected = max(active, key=lambda p: (self._current_weights[p], p))
+        self._current_weights[selected] -= total
+        return selected
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from signal_notification import views
+
+urlpatterns = [
+    path('profiling/', views.profiling_stats, name='signal_notification_profiling'),
+]
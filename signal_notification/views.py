@@ -0,0 +1,12 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse, Http404
+
+from signal_notification.notify_profiler import get_profiler
+
+
+@staff_member_required
+def profiling_stats(request):
+    profiler = get_profiler()
+    if profiler is None:
+        raise Http404('Notification profiling is disabled')
+    return JsonResponse(profiler.get_stats())